@@ -0,0 +1,180 @@
+"""
+Research Context Assembly
+
+This module builds compact prompt context from research results and document
+snippets by ranking passages against the query and packing them into a token budget.
+"""
+
+import math
+import re
+from collections import Counter
+from typing import List, Dict, Any, Tuple
+
+WORD_PATTERN = re.compile(r"\w+")
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+")
+
+# Function words dropped from queries; BM25 IDF stays positive, so matching
+# only these would otherwise let unrelated passages into the prompt
+STOPWORDS = frozenset("""
+a about all also am an and any are as at be been but by can could did do does
+for from had has have he her him his how i if in into is it its me my no not of
+on or our she so than that the their them then there these they this those to
+us was we were what when where which who whom why will with would you your
+""".split())
+
+
+def tokenize_words(text: str) -> List[str]:
+    """Lower-cased word tokens used for scoring and de-duplication"""
+    return WORD_PATTERN.findall(text.lower())
+
+
+class BM25Scorer:
+    """Okapi BM25 scoring over a small in-memory set of passages"""
+
+    def __init__(self, documents: List[List[str]], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.term_counts = [Counter(doc) for doc in documents]
+        self.lengths = [len(doc) for doc in documents]
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if documents else 0.0
+
+        document_frequency = Counter()
+        for counts in self.term_counts:
+            document_frequency.update(counts.keys())
+
+        total = len(documents)
+        self.idf = {
+            term: math.log(1 + (total - freq + 0.5) / (freq + 0.5))
+            for term, freq in document_frequency.items()
+        }
+
+    def score(self, query: List[str], index: int) -> float:
+        """Score a single passage against the query terms"""
+        counts = self.term_counts[index]
+        length_norm = 1 - self.b + self.b * self.lengths[index] / (self.avg_length or 1)
+
+        score = 0.0
+        for term in set(query):
+            freq = counts.get(term, 0)
+            if freq:
+                score += self.idf[term] * freq * (self.k1 + 1) / (freq + self.k1 * length_norm)
+        return score
+
+
+class ContextAssembler:
+    """Ranks, de-duplicates and packs passages into a fixed token budget"""
+
+    def __init__(
+        self,
+        tokenizer=None,
+        token_budget: int = 512,
+        passage_words: int = 80,
+        duplicate_threshold: float = 0.8
+    ):
+        self.tokenizer = tokenizer
+        self.token_budget = token_budget
+        self.passage_words = passage_words
+        self.duplicate_threshold = duplicate_threshold
+
+    def count_tokens(self, text: str) -> int:
+        """Count tokens with the model tokenizer, falling back to a word count"""
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False))
+        return len(text.split())
+
+    def split_passages(self, sources: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+        """Split each source's content into passages of roughly passage_words words"""
+        passages = []
+
+        for source in sources:
+            title = source.get('title', 'Unknown')
+            content = source.get('content', '') or ''
+
+            chunk = []
+            for sentence in SENTENCE_PATTERN.split(content.strip()):
+                words = sentence.split()
+                # Break sentences longer than a passage on word boundaries
+                while len(words) > self.passage_words:
+                    if chunk:
+                        passages.append({'title': title, 'content': ' '.join(chunk)})
+                        chunk = []
+                    passages.append({'title': title, 'content': ' '.join(words[:self.passage_words])})
+                    words = words[self.passage_words:]
+
+                if chunk and len(chunk) + len(words) > self.passage_words:
+                    passages.append({'title': title, 'content': ' '.join(chunk)})
+                    chunk = []
+                chunk.extend(words)
+
+            if chunk:
+                passages.append({'title': title, 'content': ' '.join(chunk)})
+
+        return passages
+
+    def rank(self, query: str, passages: List[Dict[str, str]]) -> List[Tuple[float, Dict[str, str]]]:
+        """Rank passages against the query, best first, dropping exact duplicates"""
+        unique = []
+        seen = set()
+        for passage in passages:
+            key = ' '.join(tokenize_words(passage['content']))
+            if key and key not in seen:
+                seen.add(key)
+                unique.append(passage)
+
+        documents = [tokenize_words(p['content']) for p in unique]
+        scorer = BM25Scorer(documents)
+        query_terms = [term for term in tokenize_words(query) if term not in STOPWORDS]
+
+        scored = [(scorer.score(query_terms, i), p) for i, p in enumerate(unique)]
+        # Stable sort keeps the original source order among equal scores
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return scored
+
+    def _is_near_duplicate(self, words: set, selected: List[set]) -> bool:
+        """Check word-set overlap against already selected passages
+
+        Overlap is measured against the smaller set, so a passage contained
+        in another counts as a duplicate.
+        """
+        for other in selected:
+            overlap = len(words & other) / (min(len(words), len(other)) or 1)
+            if overlap >= self.duplicate_threshold:
+                return True
+        return False
+
+    def select(self, query: str, sources: List[Dict[str, Any]], header: str = "") -> List[Dict[str, str]]:
+        """Pick the best non-redundant passages that fit in the token budget"""
+        budget = self.token_budget - (self.count_tokens(header) if header else 0)
+        selected = []
+        selected_words = []
+
+        for score, passage in self.rank(query, self.split_passages(sources)):
+            # Passages sharing no terms with the query only add prefill cost
+            if score <= 0:
+                break
+
+            words = set(tokenize_words(passage['content']))
+            if self._is_near_duplicate(words, selected_words):
+                continue
+
+            cost = self.count_tokens(self.format_passage(passage))
+            if cost > budget:
+                continue
+
+            budget -= cost
+            selected.append(passage)
+            selected_words.append(words)
+
+        return selected
+
+    @staticmethod
+    def format_passage(passage: Dict[str, str]) -> str:
+        """Format a passage as a single context line"""
+        return f"- {passage['title']}: {passage['content']}\n"
+
+    def assemble(self, query: str, sources: List[Dict[str, Any]], header: str = "") -> str:
+        """Build the context block for the query, or an empty string if nothing fits"""
+        passages = self.select(query, sources, header)
+        if not passages:
+            return ""
+        return header + ''.join(self.format_passage(p) for p in passages)
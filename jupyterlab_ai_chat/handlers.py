@@ -8,20 +8,26 @@ import os
 import json
 import asyncio
 from pathlib import Path
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 import logging
 
 from jupyter_server.base.handlers import APIHandler
 from jupyter_server.utils import url_path_join
+from jupyter_core.paths import jupyter_data_dir
 import tornado
 from tornado import web
 
+from .context import ContextAssembler
+from .store import ConversationStore
+
 try:
     import torch
     from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline
+    from transformers import StoppingCriteria, StoppingCriteriaList
     HAS_TRANSFORMERS = True
 except ImportError:
     HAS_TRANSFORMERS = False
+    StoppingCriteria = object
     print("Warning: transformers not available. Some features may not work.")
 
 try:
@@ -35,9 +41,35 @@ except ImportError:
 MODEL_DIR = os.getenv('MODEL_DIR', '/mnt/sisplockers/models')
 DEFAULT_MODEL = 'microsoft/DialoGPT-medium'
 SEARCH_API_URL = "https://api.duckduckgo.com/"
+CONVERSATION_DIR = os.getenv('AICHAT_CONVERSATION_DIR', os.path.join(jupyter_data_dir(), 'aichat'))
+
+# Default stop sequences per model family, matched against the lower-cased model name.
+# Chat/instruct models are prompted as "Human:/Assistant:" turns and tend to keep
+# writing fake "Human:" turns until max_tokens unless stopped.
+MODEL_STOP_SEQUENCES = {
+    'chat': ['\nHuman:', '\nUser:'],
+    'instruct': ['\nHuman:', '\nUser:'],
+}
 
 logger = logging.getLogger(__name__)
 
+class StopSequenceCriteria(StoppingCriteria):
+    """Stops generation as soon as a stop sequence appears in the generated text"""
+    
+    def __init__(self, tokenizer, stop_sequences: List[str], prompt_length: int):
+        self.tokenizer = tokenizer
+        self.stop_sequences = stop_sequences
+        self.prompt_length = prompt_length
+        # Only decode a short tail of new tokens per step so the check stays
+        # constant-time however long the response grows
+        longest = max(len(tokenizer.encode(s, add_special_tokens=False)) for s in stop_sequences)
+        self.window = longest + 2
+    
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        generated = input_ids[0, self.prompt_length:]
+        tail = self.tokenizer.decode(generated[-self.window:], skip_special_tokens=True)
+        return any(stop in tail for stop in self.stop_sequences)
+
 class ModelManager:
     """Manages loading and inference for local LLM models"""
     
@@ -105,19 +137,41 @@ class ModelManager:
             logger.error(f"Failed to load model {model_name}: {str(e)}")
             raise tornado.web.HTTPError(500, f"Failed to load model: {str(e)}")
     
+    def get_stop_sequences(self, model_name: str, stop: Optional[List[str]] = None) -> List[str]:
+        """Combine the model's default stop sequences with per-request ones"""
+        sequences = []
+        for key, defaults in MODEL_STOP_SEQUENCES.items():
+            if key in model_name.lower():
+                sequences.extend(defaults)
+        sequences.extend(stop or [])
+        
+        return [s for i, s in enumerate(sequences) if s and s not in sequences[:i]]
+    
     def generate_response(
         self, 
         model_name: str, 
         prompt: str, 
         temperature: float = 0.7,
         top_p: float = 0.9, 
-        max_tokens: int = 512
-    ) -> str:
-        """Generate response using the specified model"""
+        max_tokens: int = 512,
+        stop: Optional[List[str]] = None
+    ) -> Tuple[str, str]:
+        """Generate response using the specified model
+        
+        Returns the response text and the finish reason: 'stop' when EOS or a
+        stop sequence ended generation, 'length' when max_tokens was reached.
+        """
         try:
             model, tokenizer = self.load_model(model_name)
+            stop_sequences = self.get_stop_sequences(model_name, stop)
             
             inputs = tokenizer.encode(prompt, return_tensors='pt', padding=True, truncation=True)
+            prompt_length = inputs.shape[-1]
+            
+            # Always pass a list; older transformers call len() on it
+            stopping_criteria = StoppingCriteriaList()
+            if stop_sequences:
+                stopping_criteria.append(StopSequenceCriteria(tokenizer, stop_sequences, prompt_length))
             
             with torch.no_grad():
                 outputs = model.generate(
@@ -127,19 +181,26 @@ class ModelManager:
                     top_p=top_p,
                     do_sample=True,
                     pad_token_id=tokenizer.eos_token_id,
-                    eos_token_id=tokenizer.eos_token_id
+                    eos_token_id=tokenizer.eos_token_id,
+                    stopping_criteria=stopping_criteria
                 )
             
-            response = tokenizer.decode(outputs[0], skip_special_tokens=True)
+            generated = outputs[0][prompt_length:]
+            response = tokenizer.decode(generated, skip_special_tokens=True)
+            ended_on_eos = len(generated) > 0 and generated[-1].item() == tokenizer.eos_token_id
+            finish_reason = 'length' if len(generated) >= max_tokens and not ended_on_eos else 'stop'
             
-            if response.startswith(prompt):
-                response = response[len(prompt):].strip()
+            # Drop the stop sequence and anything generated after it
+            cut = min((response.find(s) for s in stop_sequences if s in response), default=-1)
+            if cut >= 0:
+                response = response[:cut]
+                finish_reason = 'stop'
             
-            return response
+            return response.strip(), finish_reason
             
         except Exception as e:
             logger.error(f"Generation error: {str(e)}")
-            return f"Sorry, I encountered an error: {str(e)}"
+            return f"Sorry, I encountered an error: {str(e)}", 'error'
 
 class ResearchHelper:
     """Helper for internet research capabilities"""
@@ -188,6 +249,7 @@ class ResearchHelper:
 # Initialize managers
 model_manager = ModelManager()
 research_helper = ResearchHelper()
+conversation_store = ConversationStore(CONVERSATION_DIR)
 
 class AIChatHandler(APIHandler):
     """Main API handler for AI chat requests"""
@@ -202,6 +264,9 @@ class AIChatHandler(APIHandler):
             top_p = float(self.get_argument('top_p', '0.9'))
             max_tokens = int(self.get_argument('max_tokens', '512'))
             deep_research = self.get_argument('deep_research', 'false').lower() == 'true'
+            # Keep whitespace: newline stop sequences are the common case
+            stop = self.get_arguments('stop', strip=False)
+            context_tokens = int(self.get_argument('context_tokens', '512'))
             
             if not message:
                 raise tornado.web.HTTPError(400, "Message is required")
@@ -216,21 +281,32 @@ class AIChatHandler(APIHandler):
             if deep_research and HAS_REQUESTS:
                 search_results = research_helper.search_web(message)
                 if search_results:
-                    research_context = "\n\nRecent information:\n"
-                    for result in search_results:
-                        research_context += f"- {result['title']}: {result['content']}\n"
-                    
+                    tokenizer = None
+                    if HAS_TRANSFORMERS:
+                        try:
+                            tokenizer = model_manager.load_model(model_name)[1]
+                        except Exception as e:
+                            # Count words instead; generation reports the load error in-band
+                            logger.warning(f"Tokenizer unavailable for context budget: {str(e)}")
+                    assembler = ContextAssembler(tokenizer=tokenizer, token_budget=context_tokens)
+                    research_context = assembler.assemble(
+                        message, search_results, header="\n\nRecent information:\n"
+                    )
+                
+                if research_context:
                     enhanced_prompt = f"Context: {research_context}\n\nUser question: {message}\n\nResponse:"
             
             if HAS_TRANSFORMERS:
-                response = model_manager.generate_response(
+                response, finish_reason = model_manager.generate_response(
                     model_name=model_name,
                     prompt=enhanced_prompt,
                     temperature=temperature,
                     top_p=top_p,
-                    max_tokens=max_tokens
+                    max_tokens=max_tokens,
+                    stop=stop
                 )
             else:
+                finish_reason = 'stop'
                 response = f"Model response simulation for: {message}"
                 if research_context:
                     response += f"\n\n(Enhanced with research: {research_context[:100]}...)"
@@ -238,7 +314,8 @@ class AIChatHandler(APIHandler):
             self.finish(json.dumps({
                 'response': response,
                 'model': model_name,
-                'research_used': bool(research_context)
+                'research_used': bool(research_context),
+                'finish_reason': finish_reason
             }))
             
         except Exception as e:
@@ -260,6 +337,112 @@ class ModelsHandler(APIHandler):
             self.set_status(500)
             self.finish(json.dumps({'error': str(e)}))
 
+class ConversationsHandler(APIHandler):
+    """Handler for listing and searching stored conversations"""
+    
+    @tornado.web.authenticated
+    async def get(self):
+        """List conversations, or search all turns when a query is given"""
+        try:
+            query = self.get_argument('q', '')
+            if query:
+                limit = int(self.get_argument('limit', '20'))
+                self.finish(json.dumps(conversation_store.search(query, limit=limit)))
+            else:
+                self.finish(json.dumps(conversation_store.list_conversations()))
+        except ValueError as e:
+            self.set_status(400)
+            self.finish(json.dumps({'error': str(e)}))
+        except Exception as e:
+            logger.error(f"Conversations handler error: {str(e)}")
+            self.set_status(500)
+            self.finish(json.dumps({'error': str(e)}))
+
+class ConversationTurnsHandler(APIHandler):
+    """Handler for paginated loading and per-turn saving of a conversation"""
+    
+    def _conversation_id(self) -> str:
+        conversation_id = self.get_argument('conversation', '')
+        if not conversation_id:
+            raise tornado.web.HTTPError(400, "Conversation is required")
+        return conversation_id
+    
+    def _write_error(self, e: Exception):
+        if isinstance(e, KeyError):
+            self.set_status(404)
+        elif isinstance(e, ValueError):
+            # Malformed JSON or non-integer seq/before/limit from the client
+            self.set_status(400)
+        elif isinstance(e, tornado.web.HTTPError):
+            self.set_status(e.status_code)
+        else:
+            logger.error(f"Conversation turns handler error: {str(e)}")
+            self.set_status(500)
+        self.finish(json.dumps({'error': str(e)}))
+    
+    @tornado.web.authenticated
+    async def get(self):
+        """Get the page of turns before `before`, newest page by default"""
+        try:
+            before = self.get_argument('before', None)
+            page = conversation_store.get_turns(
+                self._conversation_id(),
+                before=int(before) if before is not None else None,
+                limit=int(self.get_argument('limit', '50'))
+            )
+            self.finish(json.dumps(page))
+        except Exception as e:
+            self._write_error(e)
+    
+    @tornado.web.authenticated
+    async def post(self):
+        """Append a turn, or a JSON list of turns when importing a conversation"""
+        try:
+            conversation_id = self._conversation_id()
+            turns = self.get_argument('turns', '')
+            if turns:
+                turns = json.loads(turns)
+                if not isinstance(turns, list) or not all(isinstance(t, dict) for t in turns):
+                    raise tornado.web.HTTPError(400, "Turns must be a list of objects")
+                stored = conversation_store.append_turns(conversation_id, turns)
+            else:
+                stored = [conversation_store.append_turn(
+                    conversation_id,
+                    self.get_argument('role', 'user'),
+                    self.get_argument('content')
+                )]
+            self.finish(json.dumps(stored))
+        except Exception as e:
+            self._write_error(e)
+    
+    @tornado.web.authenticated
+    async def put(self):
+        """Edit an existing turn"""
+        try:
+            turn = conversation_store.update_turn(
+                self._conversation_id(),
+                int(self.get_argument('seq')),
+                self.get_argument('content')
+            )
+            self.finish(json.dumps(turn))
+        except Exception as e:
+            self._write_error(e)
+    
+    @tornado.web.authenticated
+    async def delete(self):
+        """Delete a single turn, or the whole conversation when no seq is given"""
+        try:
+            conversation_id = self._conversation_id()
+            seq = self.get_argument('seq', None)
+            if seq is not None:
+                conversation_store.delete_turn(conversation_id, int(seq))
+            else:
+                conversation_store.delete_conversation(conversation_id)
+            self.set_status(204)
+            self.finish()
+        except Exception as e:
+            self._write_error(e)
+
 def setup_handlers(server_app):
     """Setup the handlers for the server extension"""
     web_app = server_app.web_app
@@ -271,4 +454,10 @@ def setup_handlers(server_app):
     route_pattern = url_path_join(web_app.settings['base_url'], '/aichat/models')
     web_app.add_handlers(host_pattern, [(route_pattern, ModelsHandler)])
     
+    route_pattern = url_path_join(web_app.settings['base_url'], '/aichat/conversations')
+    web_app.add_handlers(host_pattern, [(route_pattern, ConversationsHandler)])
+    
+    route_pattern = url_path_join(web_app.settings['base_url'], '/aichat/conversations/turns')
+    web_app.add_handlers(host_pattern, [(route_pattern, ConversationTurnsHandler)])
+    
     logger.info("AI Chat server extension loaded") 
\ No newline at end of file
@@ -0,0 +1,204 @@
+"""
+Image OCR
+
+This module extracts text from uploaded images with a local Tesseract,
+running OCR in a process pool with a per-image time budget and a
+content-hash cache. It only imports imaging dependencies so pool workers
+start without loading any model libraries.
+"""
+
+import os
+import hashlib
+import subprocess
+import threading
+import concurrent.futures
+import multiprocessing
+from collections import OrderedDict
+from typing import List, Dict, Optional
+import logging
+
+try:
+    from PIL import Image, ImageOps
+    import pytesseract
+    # pytesseract imports fine without the tesseract binary, so check for it once
+    pytesseract.get_tesseract_version()
+    HAS_OCR = True
+except (ImportError, OSError, subprocess.CalledProcessError, SystemExit):
+    # pytesseract calls sys.exit() for an unparsable or too old tesseract
+    HAS_OCR = False
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+OCR_MAX_SIDE = int(os.getenv('AICHAT_OCR_MAX_SIDE', '2000'))
+OCR_TIMEOUT = float(os.getenv('AICHAT_OCR_TIMEOUT', '15'))
+OCR_BATCH_TIMEOUT = float(os.getenv('AICHAT_OCR_BATCH_TIMEOUT', '30'))
+OCR_WORKERS = int(os.getenv('AICHAT_OCR_WORKERS', str(min(4, os.cpu_count() or 1))))
+OCR_CACHE_SIZE = 256
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _otsu_threshold(histogram: List[int]) -> int:
+    """Pick the grey level that best separates text from background"""
+    total = sum(histogram)
+    weighted_total = sum(i * count for i, count in enumerate(histogram))
+
+    background = 0
+    weighted_background = 0.0
+    best_threshold, best_variance = 127, 0.0
+    for level, count in enumerate(histogram):
+        background += count
+        if background == 0:
+            continue
+        foreground = total - background
+        if foreground == 0:
+            break
+
+        weighted_background += level * count
+        mean_background = weighted_background / background
+        mean_foreground = (weighted_total - weighted_background) / foreground
+        variance = background * foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_threshold, best_variance = level, variance
+
+    return best_threshold
+
+
+def _ocr_image(file_path: str, timeout: float) -> str:
+    """Downscale, binarize and OCR one image (runs in a pool worker)"""
+    with Image.open(file_path) as img:
+        description = f"Image: {img.format}, Size: {img.size}"
+        grey = ImageOps.exif_transpose(img).convert('L')
+
+    if max(grey.size) > OCR_MAX_SIDE:
+        grey.thumbnail((OCR_MAX_SIDE, OCR_MAX_SIDE))
+
+    threshold = _otsu_threshold(grey.histogram())
+    binary = grey.point(lambda p: 255 if p > threshold else 0, mode='1')
+
+    text = pytesseract.image_to_string(binary, timeout=timeout).strip()
+    return f"{description}\n{text}" if text else f"{description}\n(no text detected)"
+
+
+def _create_pool(images: int) -> concurrent.futures.ProcessPoolExecutor:
+    """Create a pool for one batch of images
+
+    Each batch gets its own pool so a batch that overruns its deadline can
+    terminate its workers without failing images from concurrent requests.
+    Workers are spawned rather than forked so they don't inherit the
+    server's loaded models or CUDA state.
+    """
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=max(1, min(OCR_WORKERS, images)),
+        mp_context=multiprocessing.get_context('spawn')
+    )
+
+
+def _terminate_pool(pool: concurrent.futures.ProcessPoolExecutor):
+    """Stop a pool whose tasks are still running; they can't be cancelled"""
+    if hasattr(pool, 'terminate_workers'):
+        pool.terminate_workers()
+    else:
+        for process in list((getattr(pool, '_processes', None) or {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False)
+
+
+def _file_hash(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _cache_get(key: str) -> Optional[str]:
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    return None
+
+
+def _cache_put(key: str, text: str):
+    with _cache_lock:
+        _cache[key] = text
+        _cache.move_to_end(key)
+        while len(_cache) > OCR_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def extract_text_from_images(
+    file_paths: List[str],
+    timeout: float = OCR_TIMEOUT,
+    batch_timeout: float = OCR_BATCH_TIMEOUT
+) -> Dict[str, str]:
+    """OCR several images concurrently, returning text keyed by file path
+
+    Each image gets `timeout` seconds, after which Tesseract is killed, and
+    the whole batch gets `batch_timeout` seconds, so a batch of screenshots
+    can't hold a request for minutes however many there are.
+    """
+    results = {}
+    pending = {}
+
+    for file_path in file_paths:
+        try:
+            key = _file_hash(file_path)
+        except OSError as e:
+            results[file_path] = f"Error processing image: {str(e)}"
+            continue
+
+        cached = _cache_get(key)
+        if cached is not None:
+            results[file_path] = cached
+        else:
+            # Identical uploads are only OCR'd once
+            pending.setdefault(key, []).append(file_path)
+
+    if not pending:
+        return results
+
+    try:
+        pool = _create_pool(len(pending))
+        futures = {pool.submit(_ocr_image, paths[0], timeout): key for key, paths in pending.items()}
+    except Exception as e:
+        # Report a pool that can't start in-band, like any other image error
+        logger.error(f"OCR pool error: {str(e)}")
+        for paths in pending.values():
+            for file_path in paths:
+                results[file_path] = f"Error processing image: {str(e)}"
+        return results
+
+    done, not_done = concurrent.futures.wait(futures, timeout=batch_timeout)
+
+    # Queued images are dropped; running ones can't be cancelled, so their
+    # workers are terminated rather than left running after the request
+    still_running = [future for future in not_done if not future.cancel()]
+    if still_running:
+        logger.warning(f"Terminating OCR workers with {len(still_running)} image(s) running past the deadline")
+        _terminate_pool(pool)
+    else:
+        pool.shutdown(wait=False)
+
+    for future, key in futures.items():
+        if future in done:
+            try:
+                text = future.result()
+                _cache_put(key, text)
+            except Exception as e:
+                # pytesseract raises a bare RuntimeError when it kills a timed out run
+                if type(e) is RuntimeError and str(e) == 'Tesseract process timeout':
+                    text = f"Image text extraction timed out after {timeout:g}s"
+                else:
+                    logger.error(f"OCR error: {str(e)}")
+                    text = f"Error processing image: {str(e)}"
+        else:
+            text = f"Image text extraction skipped: batch exceeded {batch_timeout:g}s"
+
+        for file_path in pending[key]:
+            results[file_path] = text
+
+    return results
@@ -0,0 +1,313 @@
+"""
+Conversation Store
+
+This module keeps `.aichat` conversations server-side as an append-only
+per-turn log with a SQLite index for paginated loading and full-text search.
+"""
+
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from typing import List, Optional, Dict, Any, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Compact a log once superseded records make up this share of it
+COMPACT_RATIO = 0.5
+COMPACT_MIN_BYTES = 64 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id TEXT PRIMARY KEY,
+    log_bytes INTEGER NOT NULL DEFAULT 0,
+    dead_bytes INTEGER NOT NULL DEFAULT 0,
+    next_seq INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY,
+    conversation_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    created REAL NOT NULL,
+    UNIQUE (conversation_id, seq)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS turns_fts USING fts5(content);
+"""
+
+
+def _check_text(name: str, value: Any):
+    if not isinstance(value, str):
+        raise ValueError(f"Turn {name} must be a string")
+
+
+def _check_limit(limit: int):
+    # SQLite treats a negative LIMIT as unlimited
+    if limit < 1:
+        raise ValueError("Limit must be at least 1")
+
+
+class ConversationStore:
+    """Append-only conversation logs with a SQLite offset and full-text index
+
+    Every turn, edit and deletion is appended as one JSON line to the
+    conversation's log, so saving never rewrites history. The index maps
+    each live turn to its byte range in the log, which lets a page of turns
+    be read without touching the rest of the file. Logs are compacted once
+    enough of them is made up of superseded records.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.log_dir = os.path.join(root, 'logs')
+        self._db = None
+        self._lock = threading.Lock()
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        """Open the index lazily so the store costs nothing until first use"""
+        if self._db is None:
+            os.makedirs(self.log_dir, exist_ok=True)
+            self._db = sqlite3.connect(os.path.join(self.root, 'index.sqlite3'), check_same_thread=False)
+            self._db.row_factory = sqlite3.Row
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(SCHEMA)
+        return self._db
+
+    def _log_path(self, conversation_id: str) -> str:
+        """Conversation ids are file paths, so hash them into a safe file name"""
+        digest = hashlib.sha1(conversation_id.encode('utf-8')).hexdigest()
+        return os.path.join(self.log_dir, f"{digest}.jsonl")
+
+    def _append_record(self, conversation_id: str, record: Dict[str, Any]) -> Tuple[int, int]:
+        """Append one record to the log and return its offset and length"""
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8')
+        with open(self._log_path(conversation_id), 'ab') as log:
+            offset = log.tell()
+            log.write(line)
+        return offset, len(line)
+
+    def _read_records(self, conversation_id: str, ranges: List[sqlite3.Row]) -> List[Dict[str, Any]]:
+        """Read the records at the given byte ranges of a log"""
+        records = []
+        with open(self._log_path(conversation_id), 'rb') as log:
+            for row in ranges:
+                log.seek(row['offset'])
+                records.append(json.loads(log.read(row['length'])))
+        return records
+
+    def _ensure_conversation(self, conversation_id: str) -> sqlite3.Row:
+        self.db.execute(
+            "INSERT OR IGNORE INTO conversations (id, updated) VALUES (?, ?)",
+            (conversation_id, time.time())
+        )
+        return self.db.execute(
+            "SELECT * FROM conversations WHERE id = ?", (conversation_id,)
+        ).fetchone()
+
+    def _get_turn_row(self, conversation_id: str, seq: int) -> sqlite3.Row:
+        row = self.db.execute(
+            "SELECT * FROM turns WHERE conversation_id = ? AND seq = ?",
+            (conversation_id, seq)
+        ).fetchone()
+        if row is None:
+            raise KeyError(f"Turn {seq} not found in {conversation_id}")
+        return row
+
+    def append_turns(self, conversation_id: str, turns: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Append turns ({'role', 'content'}) to a conversation and return them with their seq"""
+        # Validate everything before writing so a bad turn can't leave
+        # untracked bytes in the log when the transaction rolls back
+        for turn in turns:
+            _check_text('role', turn.get('role', 'user'))
+            _check_text('content', turn.get('content', ''))
+
+        with self._lock, self.db:
+            conversation = self._ensure_conversation(conversation_id)
+            seq = conversation['next_seq']
+            written = 0
+            stored = []
+
+            for turn in turns:
+                record = {
+                    'op': 'append',
+                    'seq': seq,
+                    'role': turn.get('role', 'user'),
+                    'content': turn.get('content', ''),
+                    'created': time.time()
+                }
+                offset, length = self._append_record(conversation_id, record)
+                written += length
+
+                cursor = self.db.execute(
+                    "INSERT INTO turns (conversation_id, seq, role, offset, length, created) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (conversation_id, seq, record['role'], offset, length, record['created'])
+                )
+                self.db.execute(
+                    "INSERT INTO turns_fts (rowid, content) VALUES (?, ?)",
+                    (cursor.lastrowid, record['content'])
+                )
+                stored.append({k: v for k, v in record.items() if k != 'op'})
+                seq += 1
+
+            self.db.execute(
+                "UPDATE conversations SET log_bytes = log_bytes + ?, next_seq = ?, updated = ? WHERE id = ?",
+                (written, seq, time.time(), conversation_id)
+            )
+        return stored
+
+    def append_turn(self, conversation_id: str, role: str, content: str) -> Dict[str, Any]:
+        """Append a single turn to a conversation"""
+        return self.append_turns(conversation_id, [{'role': role, 'content': content}])[0]
+
+    def update_turn(self, conversation_id: str, seq: int, content: str) -> Dict[str, Any]:
+        """Replace a turn's content by appending a new version of it"""
+        _check_text('content', content)
+        with self._lock, self.db:
+            old = self._get_turn_row(conversation_id, seq)
+            record = {
+                'op': 'edit',
+                'seq': seq,
+                'role': old['role'],
+                'content': content,
+                'created': old['created']
+            }
+            offset, length = self._append_record(conversation_id, record)
+
+            self.db.execute(
+                "UPDATE turns SET offset = ?, length = ? WHERE id = ?", (offset, length, old['id'])
+            )
+            self.db.execute(
+                "UPDATE turns_fts SET content = ? WHERE rowid = ?", (content, old['id'])
+            )
+            self.db.execute(
+                "UPDATE conversations SET log_bytes = log_bytes + ?, dead_bytes = dead_bytes + ?, "
+                "updated = ? WHERE id = ?",
+                (length, old['length'], time.time(), conversation_id)
+            )
+
+        self._maybe_compact(conversation_id)
+        return {k: v for k, v in record.items() if k != 'op'}
+
+    def delete_turn(self, conversation_id: str, seq: int):
+        """Delete a turn by appending a tombstone record"""
+        with self._lock, self.db:
+            old = self._get_turn_row(conversation_id, seq)
+            offset, length = self._append_record(conversation_id, {'op': 'delete', 'seq': seq})
+
+            self.db.execute("DELETE FROM turns WHERE id = ?", (old['id'],))
+            self.db.execute("DELETE FROM turns_fts WHERE rowid = ?", (old['id'],))
+            self.db.execute(
+                "UPDATE conversations SET log_bytes = log_bytes + ?, dead_bytes = dead_bytes + ?, "
+                "updated = ? WHERE id = ?",
+                (length, old['length'] + length, time.time(), conversation_id)
+            )
+
+        self._maybe_compact(conversation_id)
+
+    def get_turns(self, conversation_id: str, before: Optional[int] = None, limit: int = 50) -> Dict[str, Any]:
+        """Load the page of turns preceding `before` (the newest page by default), oldest first"""
+        _check_limit(limit)
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT seq, offset, length FROM turns WHERE conversation_id = ? AND seq < ? "
+                "ORDER BY seq DESC LIMIT ?",
+                (conversation_id, before if before is not None else 2 ** 62, limit + 1)
+            ).fetchall()
+
+            has_more = len(rows) > limit
+            rows = list(reversed(rows[:limit]))
+            turns = self._read_records(conversation_id, rows) if rows else []
+
+        return {
+            'turns': [{k: v for k, v in t.items() if k != 'op'} for t in turns],
+            'has_more': has_more
+        }
+
+    def list_conversations(self) -> List[Dict[str, Any]]:
+        """List stored conversations, most recently updated first"""
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT c.id, c.updated, COUNT(t.seq) AS turn_count FROM conversations c "
+                "LEFT JOIN turns t ON t.conversation_id = c.id "
+                "GROUP BY c.id ORDER BY c.updated DESC"
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def search(self, query: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """Full-text search across all conversations, best matches first"""
+        _check_limit(limit)
+        # Quote each term so user input cannot be parsed as FTS query syntax
+        terms = ['"' + term.replace('"', '""') + '"' for term in query.split()]
+        if not terms:
+            return []
+
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT t.conversation_id, t.seq, t.role, "
+                "snippet(turns_fts, 0, '[', ']', '...', 16) AS snippet "
+                "FROM turns_fts JOIN turns t ON t.id = turns_fts.rowid "
+                "WHERE turns_fts MATCH ? ORDER BY rank LIMIT ?",
+                (' '.join(terms), limit)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def delete_conversation(self, conversation_id: str):
+        """Remove a conversation's log and index entries"""
+        with self._lock, self.db:
+            self.db.execute(
+                "DELETE FROM turns_fts WHERE rowid IN (SELECT id FROM turns WHERE conversation_id = ?)",
+                (conversation_id,)
+            )
+            self.db.execute("DELETE FROM turns WHERE conversation_id = ?", (conversation_id,))
+            self.db.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
+
+            log_path = self._log_path(conversation_id)
+            if os.path.exists(log_path):
+                os.remove(log_path)
+
+    def _maybe_compact(self, conversation_id: str):
+        row = self.db.execute(
+            "SELECT log_bytes, dead_bytes FROM conversations WHERE id = ?", (conversation_id,)
+        ).fetchone()
+        if row and row['log_bytes'] >= COMPACT_MIN_BYTES and row['dead_bytes'] >= row['log_bytes'] * COMPACT_RATIO:
+            self.compact(conversation_id)
+
+    def compact(self, conversation_id: str):
+        """Rewrite a log with only the live version of each turn"""
+        with self._lock, self.db:
+            rows = self.db.execute(
+                "SELECT seq, offset, length FROM turns WHERE conversation_id = ? ORDER BY seq",
+                (conversation_id,)
+            ).fetchall()
+            records = self._read_records(conversation_id, rows) if rows else []
+
+            log_path = self._log_path(conversation_id)
+            tmp_path = log_path + '.tmp'
+            offset = 0
+            with open(tmp_path, 'wb') as log:
+                for record in records:
+                    record['op'] = 'append'
+                    line = (json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8')
+                    log.write(line)
+                    self.db.execute(
+                        "UPDATE turns SET offset = ?, length = ? WHERE conversation_id = ? AND seq = ?",
+                        (offset, len(line), conversation_id, record['seq'])
+                    )
+                    offset += len(line)
+                log.flush()
+                os.fsync(log.fileno())
+
+            os.replace(tmp_path, log_path)
+            self.db.execute(
+                "UPDATE conversations SET log_bytes = ?, dead_bytes = 0 WHERE id = ?",
+                (offset, conversation_id)
+            )
+        logger.info(f"Compacted conversation log for {conversation_id}")
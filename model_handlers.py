@@ -12,6 +12,9 @@ from typing import List, Dict, Any, Optional, Union
 from pathlib import Path
 import logging
 
+from jupyterlab_ai_chat.context import ContextAssembler
+from jupyterlab_ai_chat import ocr
+
 try:
     import torch
     from transformers import AutoTokenizer, AutoModelForCausalLM
@@ -24,6 +27,8 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+IMAGE_EXTENSIONS = ['jpg', 'jpeg', 'png', 'gif']
+
 class DocumentProcessor:
     """Handles document processing for context augmentation"""
     
@@ -44,13 +49,20 @@ class DocumentProcessor:
             logger.error(f"PDF extraction error: {str(e)}")
             return f"Error extracting PDF: {str(e)}"
     
+    @staticmethod
+    def extract_text_from_images(file_paths: List[str]) -> Dict[str, str]:
+        """Extract text from several images concurrently, keyed by file path"""
+        if ocr.HAS_OCR:
+            return ocr.extract_text_from_images(file_paths)
+        return {path: DocumentProcessor.extract_text_from_image(path) for path in file_paths}
+    
     @staticmethod
     def extract_text_from_image(file_path: str) -> str:
-        """Extract text from image using OCR (placeholder)"""
-        # This would require OCR libraries like pytesseract
-        # For now, return image metadata
+        """Extract text from image using OCR, falling back to image metadata"""
         try:
-            if HAS_EXTRAS:
+            if ocr.HAS_OCR:
+                return ocr.extract_text_from_images([file_path])[file_path]
+            elif HAS_EXTRAS:
                 with Image.open(file_path) as img:
                     return f"Image: {img.format}, Size: {img.size}, Mode: {img.mode}"
             else:
@@ -64,7 +76,7 @@ class DocumentProcessor:
         try:
             if file_type.lower() == 'pdf':
                 return DocumentProcessor.extract_text_from_pdf(file_path)
-            elif file_type.lower() in ['jpg', 'jpeg', 'png', 'gif']:
+            elif file_type.lower() in IMAGE_EXTENSIONS:
                 return DocumentProcessor.extract_text_from_image(file_path)
             elif file_type.lower() in ['txt', 'md']:
                 with open(file_path, 'r', encoding='utf-8') as f:
@@ -177,10 +189,17 @@ class AdvancedFeatures:
         """Create rich context from multiple uploaded files"""
         context = "Document Context:\n"
         
+        # OCR all images in one concurrent batch rather than one at a time
+        image_paths = [p for p in file_paths if Path(p).suffix.lower().lstrip('.') in IMAGE_EXTENSIONS]
+        image_text = DocumentProcessor.extract_text_from_images(image_paths) if image_paths else {}
+        
         for file_path in file_paths:
             try:
                 file_extension = Path(file_path).suffix.lower().lstrip('.')
-                content = DocumentProcessor.process_uploaded_file(file_path, file_extension)
+                if file_path in image_text:
+                    content = image_text[file_path]
+                else:
+                    content = DocumentProcessor.process_uploaded_file(file_path, file_extension)
                 filename = Path(file_path).name
                 context += f"\n--- {filename} ---\n{content}\n"
             except Exception as e:
@@ -189,15 +208,26 @@ class AdvancedFeatures:
         return context
     
     @staticmethod
-    def enhance_prompt_with_research(prompt: str, research_results: List[Dict]) -> str:
-        """Enhance prompt with research context"""
+    def enhance_prompt_with_research(
+        prompt: str,
+        research_results: List[Dict],
+        tokenizer=None,
+        token_budget: int = 512
+    ) -> str:
+        """Enhance prompt with the research passages most relevant to it
+        
+        research_results may also include document snippets in the same
+        {'title', 'content'} form.
+        """
         if not research_results:
             return prompt
         
-        enhanced = f"Research Context:\n"
-        for result in research_results[:3]:  # Limit to top 3 results
-            enhanced += f"- {result.get('title', 'Unknown')}: {result.get('content', '')[:200]}...\n"
+        assembler = ContextAssembler(tokenizer=tokenizer, token_budget=token_budget)
+        context = assembler.assemble(prompt, research_results, header="Research Context:\n")
+        if not context:
+            return prompt
         
+        enhanced = context
         enhanced += f"\nUser Query: {prompt}\n\nPlease provide a comprehensive response using the above context when relevant:"
         return enhanced
     
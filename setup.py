@@ -95,6 +95,10 @@ setup_args = dict(
         "dev": [
             "jupyter_packaging~=0.10",
             "jupyterlab~=3.1",
+        ],
+        "ocr": [
+            "Pillow>=8.0",
+            "pytesseract>=0.3.8",
         ]
     },
     zip_safe=False,